@@ -1,12 +1,14 @@
 #!/usr/bin/python
 
-import os, sys, string
+import operator, re, sys
+from array import array
 
 ###
 #
 # Implements a simple calculator.
 #
 # Reads lines from stdin (keyboard) and computes the answer.
+# Piped input is read all at once and answered line by line.
 # Lines can look like this:
 #  1 + 2 * 3
 #  (5-2)/3.0
@@ -57,13 +59,25 @@ Op_Sets: tuple[int, str, list[str]] = [
 	( BINARYOP, RIGHT, ["**"] ),			# Exponentiation
 ]
 
-Op_Table = {}
+# Operators are stored in Expr nodes as integer opcodes, numbered in the
+# order they appear in Op_Sets.
+(OP_OR, OP_XOR, OP_AND, OP_LSHIFT, OP_RSHIFT, OP_ADD, OP_SUB,
+ OP_MUL, OP_DIV, OP_MOD, OP_POS, OP_NEG, OP_INVERT, OP_POW) = range(14)
+
+OP_NAMES: tuple[str, ...] = tuple(op for kind, associativity, ops in Op_Sets for op in ops)
+OP_CODES: dict[str, int] = {op: code for code, op in enumerate(OP_NAMES)}
+
+# Operator metadata, filled in by build_Op_Table().
+OP_ASSOC_IS_LEFT: dict[str, bool] = {}
+OP_PREC: dict[str, int] = {}
+
 def build_Op_Table():
 	precedence = 0
 	for kind, associativity, ops in Op_Sets:
 		precedence += 1
 		for op in ops:
-			Op_Table[op] = (kind, associativity, precedence)
+			OP_ASSOC_IS_LEFT[op] = associativity == LEFT
+			OP_PREC[op] = precedence
 
 # Note the following are listed in order of longest to shortest.
 Predefined_Tokens: list[str] = [
@@ -75,168 +89,238 @@ Predefined_Tokens: list[str] = [
 	"|", "^", "&",
 ]
 
+# A single pass over the line matches whitespace, numeric literals and the
+# predefined tokens. Anything else is an incomprehensible character.
+TOKEN_RE = re.compile(r"""
+	(?P<SPACE>\s+)
+	|(?P<HEX>0[xX][0-9a-fA-F]+)
+	|(?P<OCT>0o[0-7]+)
+	|(?P<BIN>0b[01]+)
+	|(?P<FLOAT>(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?|\d+[eE][-+]?\d+)
+	|(?P<INT>\d+)
+	|(?P<PUNCT>%s)
+	|(?P<ERROR>.)
+""" % "|".join(re.escape(tok) for tok in Predefined_Tokens), re.VERBOSE | re.ASCII)
+
 # Break the line into a list of string tokens.
 # E.g. "(3+17<<2)" becomes ["(", "3", "+", "17", "<<", "2", ")"]
 def tokenise(line: str) -> list[str]:
 	tokens = []
-	start = 0
-	while start < len(line):
-		# Skip whitespace.
-		if line[start:start+1] in " \t\n":
-			start += 1
+	for m in TOKEN_RE.finditer(line):
+		kind = m.lastgroup
+		if kind == 'SPACE':
 			continue
+		if kind == 'ERROR':
+			# Incomprehensible character?
+			break
+		tokens.append(m.group())
+	return tokens
 
-		# Remember any predefined token.
-		found_punct = False
-		for tok in Predefined_Tokens:
-			finish = start + len(tok)
-			if line[start:finish] == tok:
-				tokens.append(tok)
-				start = finish
-				found_punct = True
-				break
-		if found_punct:
-			continue
+# Tokenise many lines (split on "\n", without the newline) in one pass over a
+# single buffer.
+# E.g. ["1+2", "3*4"] becomes [["1", "+", "2"], ["3", "*", "4"]]
+# Each line stops at its first incomprehensible character, like tokenise().
+def tokenise_batch(lines: list[str]) -> list[list[str]]:
+	if not lines:
+		return []
 
-		# Remember any numbers.
-		i = start
-		while i < len(line) and line[i] in "0123456789abcdefABCDEF.xXbo":
-			i += 1
-		if i > start:
-			tok = line[start:i]
-			tokens.append(tok)
-			start = i
+	tokens = []
+	batch = [tokens]
+	skipping = False
+	for m in TOKEN_RE.finditer("\n".join(lines)):
+		kind = m.lastgroup
+		if kind == 'SPACE':
+			for i in range(m.group().count("\n")):
+				tokens = []
+				batch.append(tokens)
+				skipping = False
 			continue
-
-		# Incomprehensible character?
-		break
-
-	return tokens
+		if skipping:
+			continue
+		if kind == 'ERROR':
+			skipping = True
+			continue
+		tokens.append(m.group())
+	return batch
+
+def truediv_safe(x, y):
+	if y:
+		return x / float(y)
+	print("Error: division by zero.")
+	return None
+
+def mod_safe(x, y):
+	if type(y) is int and y:
+		return x % y
+	if y:
+		return x % int(y)
+	print("Error: modulo by zero.")
+	return None
+
+def pow_float(x, y):
+	return float(x) ** float(y)
+
+def pos_unary(x, y):
+	return +y
+
+def neg_unary(x, y):
+	return -y
+
+def invert_int(x, y):
+	return ~int(y)
+
+# The function for each opcode, called with its left and right operands.
+# Unary operators ignore the (missing) left operand.
+OP_FUNCS = (
+	operator.or_,		# OP_OR
+	operator.xor,		# OP_XOR
+	operator.and_,		# OP_AND
+	operator.lshift,	# OP_LSHIFT
+	operator.rshift,	# OP_RSHIFT
+	operator.add,		# OP_ADD
+	operator.sub,		# OP_SUB
+	operator.mul,		# OP_MUL
+	truediv_safe,		# OP_DIV
+	mod_safe,		# OP_MOD
+	pos_unary,		# OP_POS
+	neg_unary,		# OP_NEG
+	invert_int,		# OP_INVERT
+	pow_float,		# OP_POW
+)
+
+# The shape of an Expr node, fixed when it is constructed.
+KIND_TOK, KIND_UNARY, KIND_BINARY, KIND_EMPTY, KIND_OTHER = range(5)
 
 class Expr:
-	def __init__(self, tok: str = None, op: str = None, left=None, right=None):
+	__slots__ = ('tok', 'op', 'left', 'right', 'kind')
+
+	def __init__(self, tok: str = None, op: int = None, left=None, right=None):
 		self.tok   = tok
 		self.op    = op
 		self.left  = left
 		self.right = right
 
+		if tok is not None:
+			self.kind = KIND_TOK
+		elif op is None:
+			self.kind = KIND_EMPTY if left is None and right is None else KIND_OTHER
+		elif right is None:
+			self.kind = KIND_OTHER
+		elif left is None:
+			self.kind = KIND_UNARY
+		else:
+			self.kind = KIND_BINARY
+
 	def __str__(self) -> str:
-		s = "("
-		if self.tok:   s += "Token: " + str(self.tok) + " "
-		if self.left:  s += "Left: "  + str(self.left) + " "
-		if self.op:    s += "Op: "    + str(self.op) + " "
-		if self.right: s += "Right: " + str(self.right) + " "
-		return s[:-1] + ")"
+		parts = []
+		self.append_str(parts)
+		return "".join(parts)
+
+	# Append the pieces of this node's string, and its children's, to parts.
+	def append_str(self, parts: list[str]):
+		parts.append("(")
+		if self.tok is not None:
+			parts += ["Token: ", str(self.tok), " "]
+		if self.left:
+			parts.append("Left: ")
+			self.left.append_str(parts)
+			parts.append(" ")
+		if self.op is not None:
+			parts += ["Op: ", OP_NAMES[self.op], " "]
+		if self.right:
+			parts.append("Right: ")
+			self.right.append_str(parts)
+			parts.append(" ")
+		if parts[-1] == " ":
+			parts[-1] = ")"
+		else:
+			parts.append(")")
 
 	def __repr__(self) -> str:
 		return str(self)
 
 	def is_empty(self) -> bool:
-		if self.tok:   return False
-		if self.op:    return False
-		if self.left:  return False
-		if self.right: return False
-		return True
+		return self.kind == KIND_EMPTY
 
 	def is_token(self) -> bool:
-		if self.tok: return True
-		return False
+		return self.kind == KIND_TOK
 
 	def is_unary_expr(self) -> bool:
-		if self.op and not self.left and self.right:
-			return True
-		return False
-
-	def is_parenth_expr(self) -> bool:
-		if not self.op and not self.left and self.right:
-			return True
-		return False
+		return self.kind == KIND_UNARY
 
 	def is_binary_exprs(self) -> bool:
-		if self.op and self.left and self.right:
-			return True
-		return False
+		return self.kind == KIND_BINARY
 
 	def evaluate(self):
-		if self.is_token() and type(self.tok) == type(''):
+		kind = self.kind
+		if kind == KIND_TOK and type(self.tok) == type(''):
 			return to_number(self.tok)
-		if self.is_token() and type(self.tok) in [type(0.0), type(0)]:
+		if kind == KIND_TOK:
+			# A literal folded at parse time: int, float or complex.
 			return self.tok
-		if self.is_parenth_expr():
-			return self.right.evaluate()
-		if self.op and not self.left and not self.right:
+		if self.op is not None and not self.left and not self.right:
 			print("Error:", repr(self), "has too few items.")
 			return None
 
 		if not self.left:
 			x = None
-		elif self.left.is_empty():
+		elif self.left.kind == KIND_EMPTY:
 			x = None
 		else:
 			x = self.left.evaluate()
 
 		if not self.right:
 			return x
-		elif self.right.is_empty():
+		elif self.right.kind == KIND_EMPTY:
 			y = None
 		else:
 			y = self.right.evaluate()
 
-		if not self.op:
+		if self.op is None:
 			# Leaf node.
-			if x: x = float(x)
-			if y: x = float(y)
 			print("Parse error: leaf node wasn't a literal number.")
-			return
-		elif self.op == '|':    return x | y
-		elif self.op == '^':    return x ^ y
-		elif self.op == '&':    return x & y
-		elif self.op == '<<':   return x << y
-		elif self.op == '>>':   return x >> y
-		elif self.op == '+':    return x + y
-		elif self.op == '-':    return x - y
-		elif self.op == '*':    return x * y
-		elif self.op == '/':
-			if y:
-				   return x / float(y)
-			else:
-				   print("Error: division by zero.")
-				   return None
-		elif self.op == '%':
-			if y:
-				   return x % int(y)
-			else:
-				   print("Error: modulo by zero.")
-				   return
-		elif self.op == '+ x':  return +y
-		elif self.op == '- x':  return -y
-		elif self.op == '~ x':  return ~int(y)
-		elif self.op == '**':   return float(x) ** float(y)
-		else:
+			return None
+
+		if not 0 <= self.op < len(OP_FUNCS):
 			print("Error: evaluating")
 			return None
+		return OP_FUNCS[self.op](x, y)
 
 class Parser:
 	def __init__(self, tokens: list[str] = []):
-		self.current_tokens = tokens[:]
-		self.current_index = 0
+		self.set_tokens(tokens)
 
 	def set_tokens(self, tokens: list[str] = []):
-		self.current_tokens = tokens[:]
-		self.current_index = 0
+		self._it = iter(tokens)
+		self._lookahead = next(self._it, None)
+		self.had_error = False
 
 	def parse_error(self, s: str):
 		print("Parse error:", s)
+		self.had_error = True
 
 	def get_curr_token(self) -> str:
-		if self.current_index < len(self.current_tokens):
-			return self.current_tokens[self.current_index]
-		else:
-			return None
+		return self._lookahead
 
 	def get_next_token(self) -> str:
-		self.current_index += 1
-		return self.get_curr_token()
+		self._lookahead = next(self._it, None)
+		return self._lookahead
+
+	# Collapse an operator whose operands are all literals into a single
+	# literal. Division and modulo by zero, and operations that raise, are left
+	# to report at evaluation.
+	def fold(self, expr: Expr) -> Expr:
+		if not expr.right or expr.right.kind != KIND_TOK:
+			return expr
+		if expr.left and expr.left.kind != KIND_TOK:
+			return expr
+		if expr.op in (OP_DIV, OP_MOD) and not expr.right.evaluate():
+			return expr
+		try:
+			value = expr.evaluate()
+		except (ArithmeticError, TypeError, ValueError):
+			return expr
+		return Expr(tok=value)
 
 	def parse_atom(self, min_prec: int) -> Expr:
 		tok = self.get_curr_token()
@@ -250,107 +334,157 @@ class Parser:
 				if self.get_curr_token() != ')':
 					self.parse_error('unmatched "("')
 				self.get_next_token()
-				return Expr(right=subexpr)
+				return subexpr
 			elif tok in ['-', '+', '~', 'not']:
 				op = tok + " x"
-				kind, associativity, precedence = Op_Table[op]
 				self.get_next_token()
-				subexpr = self.parse_expr(precedence)
-				return Expr(op=op, right=subexpr)
-			elif tok in Op_Table:
+				subexpr = self.parse_expr(OP_PREC[op])
+				return self.fold(Expr(op=OP_CODES[op], right=subexpr))
+			elif tok in OP_PREC:
 				self.parse_error('expected an atom, not an operator "%s"' % tok)
 				return Expr()
 			else:
 				self.get_next_token()
 				return Expr(tok=tok)
 
+	# Replace the top two operands with the operator applied to them.
+	def reduce(self, operands: list[Expr], opcode: int):
+		rhs = operands.pop()
+		lhs = operands.pop()
+		operands.append(self.fold(Expr(op=opcode, left=lhs, right=rhs)))
+
 	def parse_expr(self, min_prec: int = 0) -> Expr:
-		lhs = self.parse_atom(min_prec)
-		ops = []
+		operands = [self.parse_atom(min_prec)]
+		operators = [] # (opcode, precedence) pairs awaiting their right operand.
 
 		while True:
-			if lhs.is_token() and lhs.tok in Op_Table:
-				op = lhs.tok
-				lhs = None
-			else:
-				tok = self.get_curr_token()
-				if tok is None:
-					break
-				if tok not in Op_Table:
-					break
-				op = tok
-			# Get the operator's precedence and associativity.
-			kind, associativity, precedence = Op_Table[op]
+			# Stop at the end of the source, at a non-operator, or at an
+			# operator that binds more loosely than this call accepts.
+			tok = self.get_curr_token()
+			precedence = OP_PREC.get(tok, -1)
 			if precedence < min_prec:
 				break
 
-			# Compute a minimal precedence for the recursive call.
-			if associativity == LEFT:
-				next_min_prec = precedence + 1
-			else:
-				next_min_prec = precedence
+			# Reduce the pending operators that bind at least as tightly.
+			while operators:
+				prev_opcode, prev_precedence = operators[-1]
+				if prev_precedence < precedence:
+					break
+				if prev_precedence == precedence and not OP_ASSOC_IS_LEFT[tok]:
+					break
+				operators.pop()
+				self.reduce(operands, prev_opcode)
 
-			# Consume the current token and prepare the next one for the
-			# recursive call.
+			# Consume the operator and parse its right operand.
+			operators.append((OP_CODES[tok], precedence))
 			self.get_next_token()
-			rhs = self.parse_expr(next_min_prec)
-
-			# Update lhs with the new value.
-			if kind == UNARYOP:
-				lhs = Expr(op=op, right=rhs) # UNARYOP
-			elif lhs.is_token():
-				lhs = Expr(op=op, left=lhs, right=rhs) # BINARYOP
-			elif lhs.is_parenth_expr():
-				lhs = Expr(op=op, left=lhs.right, right=rhs) # BINARYOP
-			else:
-				prev_op = lhs.op
-				prev_kind, prev_associativity, prev_precedence = Op_Table[prev_op]
-				if prev_kind == BINARYOP and prev_associativity == associativity and prev_precedence == precedence:
-					lhs = Expr(op=op, left=lhs, right=rhs)
-				elif kind == UNARYOP:
-					lhs = Expr(ops=op, right=rhs) # UNARYOP
-				elif kind == BINARYOP:
-					lhs = Expr(op=op, left=lhs, right=rhs) # BINARYOP
+			operands.append(self.parse_atom(precedence))
+
+		while operators:
+			opcode, precedence = operators.pop()
+			self.reduce(operands, opcode)
+
+		return operands[0]
+
+# Pushes the next literal onto the stack when evaluating a program.
+OP_PUSH = -1
+
+# Flatten an Expr tree into a postfix program: an array of opcodes and the
+# list of literals that its OP_PUSH entries consume in order.
+# E.g. "1 + 2 * 3" becomes [OP_PUSH, OP_PUSH, OP_PUSH, OP_MUL, OP_ADD], [1, 2, 3]
+def compile_expr(expr: Expr) -> tuple[array, list]:
+	ops = array('b')
+	literals = []
+
+	def emit(node: Expr):
+		kind = node.kind
+		if kind == KIND_TOK:
+			ops.append(OP_PUSH)
+			literals.append(node.evaluate())
+		elif kind == KIND_EMPTY:
+			ops.append(OP_PUSH)
+			literals.append(None)
+		elif kind == KIND_UNARY:
+			emit(node.right)
+			ops.append(node.op)
+		else:
+			emit(node.left)
+			emit(node.right)
+			ops.append(node.op)
+
+	emit(expr)
+	return ops, literals
+
+# Run a program from compile_expr() and return its result.
+# Globals and bound methods are hoisted into locals for the inner loop.
+def evaluate_program(ops: array, literals: list) -> int | float:
+	funcs = OP_FUNCS
+	push_op, first_unary, last_unary = OP_PUSH, OP_POS, OP_INVERT
+	next_literal = iter(literals).__next__
+	values = []
+	push = values.append
+	pop = values.pop
+	for op in ops:
+		if op == push_op:
+			push(next_literal())
+		elif first_unary <= op <= last_unary:
+			push(funcs[op](None, pop()))
+		else:
+			y = pop()
+			push(funcs[op](pop(), y))
+	return values[-1]
 
-		return lhs
+# Numeric base for each literal prefix the tokeniser accepts.
+Radix_Prefixes: dict[str, int] = {"0x": 16, "0X": 16, "0o": 8, "0b": 2}
 
 def to_number(tok: str) -> int | float:
-	if tok[:2] == "0x":
-		return int(tok[2:], 16)
-	if tok[:2] == "0X":
-		return int(tok[2:], 16)
-	if tok[:2] == "0o":
-		return int(tok[2:], 8)
-	if tok[:2] == "0b":
-		return int(tok[2:], 2)
-	if '.' in tok:
-		return float(tok)
-	if 'e' in tok:
-		return float(tok)
-	if 'E' in tok:
-		return float(tok)
-	return int(tok)
+	base = Radix_Prefixes.get(tok[:2])
+	if base:
+		return int(tok[2:], base)
+	if tok.isdecimal():
+		return int(tok)
+	return float(tok)
+
+# A single parser is built by setup() and reused for every line.
+_PARSER: Parser = None
+
+# Compiled programs for recently parsed token sequences, oldest first.
+# Lines with parse errors are not cached, so their errors are reported again.
+_AST_CACHE: dict[tuple[str, ...], tuple[array, list]] = {}
+_AST_CACHE_SIZE = 1024
+
+def compile_tokens(tokens: list[str]) -> tuple[array, list]:
+	key = tuple(tokens)
+	program = _AST_CACHE.get(key)
+	if program is None:
+		_PARSER.set_tokens(tokens)
+		program = compile_expr(_PARSER.parse_expr())
+		if not _PARSER.had_error:
+			if len(_AST_CACHE) >= _AST_CACHE_SIZE:
+				del _AST_CACHE[next(iter(_AST_CACHE))]
+			_AST_CACHE[key] = program
+	return program
 
 def parse_and_print(line: str):
-	tokens = tokenise(line)
+	print_tokens(tokenise(line))
+
+def print_tokens(tokens: list[str]):
 	if not tokens:
 		return
 
-	parser = Parser(tokens)
-	expr = parser.parse_expr()
-	print(expr.evaluate())
+	print(evaluate_program(*compile_tokens(tokens)))
 
 def parse(line: str):
 	tokens = tokenise(line)
 	if not tokens:
 		return None
 
-	parser = Parser(tokens)
-	expr = parser.parse_expr()
-	return expr.evaluate()
+	return evaluate_program(*compile_tokens(tokens))
 
 def setup():
+	global _PARSER
 	build_Op_Table()
+	_PARSER = Parser()
 
 def main():
 	setup()
@@ -358,11 +492,15 @@ def main():
 		lines = sys.argv[1:]
 		for line in lines:
 			parse_and_print(line)
-	else:
+	elif sys.stdin.isatty():
 		line = sys.stdin.readline()
 		while line:
 			parse_and_print(line)
 			line = sys.stdin.readline()
+	else:
+		# Piped input is read and tokenised in one go.
+		for tokens in tokenise_batch(sys.stdin.read().split("\n")):
+			print_tokens(tokens)
 
 if __name__ == '__main__':
 	main()